@@ -3,11 +3,13 @@ import os
 import logging
 import asyncio
 import json
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 from urllib.parse import urlparse
-from datetime import datetime
-from typing import Dict, List
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import Dict, List, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler,
@@ -15,6 +17,11 @@ from telegram.ext import (
 )
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from checker import WebsiteChecker
+from delivery import ReportDelivery
+from planner import (
+    PrecomputedResults, SiteCostTracker, collect_daily_reports, next_delivery_time,
+    precompute, precompute_lead, should_start_precompute
+)
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -23,6 +30,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 DATA_FILE = Path("user_sites.json")
+OUTBOX_FILE = Path("outbox.json")
+COSTS_FILE = Path("site_costs.json")
+RESULTS_FILE = Path("daily_results.json")
 
 load_dotenv()  # текущая рабочая директория (PyCharm часто ставит корень проекта)
 load_dotenv(dotenv_path=Path(__file__).with_name(".env"), override=False)
@@ -34,6 +44,16 @@ if not BOT_TOKEN:
 TZ = os.getenv("TIMEZONE", "Europe/Riga")
 DAILY_HOUR = int(os.getenv("DAILY_HOUR", "9"))
 DAILY_MINUTE = int(os.getenv("DAILY_MINUTE", "0"))
+# Лимиты Telegram: ~30 сообщений/с глобально и ~1/с в один чат
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "25"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+OUTBOX_RETRY_MINUTES = int(os.getenv("OUTBOX_RETRY_MINUTES", "30"))
+OUTBOX_MAX_AGE_HOURS = float(os.getenv("OUTBOX_MAX_AGE_HOURS", "24"))
+# Проверки растягиваются на окно перед DAILY_HOUR:DAILY_MINUTE (0 — всё в момент отправки).
+# Если по оценке они не влезают в окно, предрасчёт начинается раньше.
+PRECOMPUTE_WINDOW_MINUTES = min(max(int(os.getenv("PRECOMPUTE_WINDOW_MINUTES", "120")), 0), 23 * 60)
+PRECOMPUTE_MARGIN_MINUTES = int(os.getenv("PRECOMPUTE_MARGIN_MINUTES", "10"))
+PRECOMPUTE_PLAN_MINUTES = int(os.getenv("PRECOMPUTE_PLAN_MINUTES", "5"))
 
 # === Работа с файлами ===
 def load_user_sites() -> Dict[str, List[str]]:
@@ -302,33 +322,95 @@ async def check_all_sites(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.message.reply_text("\n\n".join(report)[:4000])
 
 # === Автопроверка ===
+async def site_report(url: str) -> Tuple[str, bool]:
+    """Полная проверка сайта для отчёта: (текст, прошла ли проверка без ошибки)."""
+    try:
+        result = await run_checker("all", url)
+        return f"✅ {url}:\n{result}", True
+    except Exception as e:
+        return f"❌ {url}: {e}", False
+
+def all_site_urls(data: Dict[str, List[str]]) -> List[str]:
+    return list(dict.fromkeys(url for sites in data.values() for url in sites))
+
+def log_task_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception():
+        logger.error("Предрасчёт завершился с ошибкой", exc_info=task.exception())
+
+async def plan_precompute(app):
+    """Запускает предрасчёт, как только до рассылки остаётся меньше, чем он займёт."""
+    now = datetime.now(ZoneInfo(TZ))
+    delivery_at = next_delivery_time(now, DAILY_HOUR, DAILY_MINUTE)
+    delivery_date = delivery_at.date().isoformat()
+    if app.bot_data.get("precompute_date") == delivery_date:
+        return
+
+    tracker: SiteCostTracker = app.bot_data["costs"]
+    urls = all_site_urls(load_user_sites())
+    lead = precompute_lead(tracker.total_estimate(urls), PRECOMPUTE_WINDOW_MINUTES, PRECOMPUTE_MARGIN_MINUTES)
+    # следующий запуск планировщика будет только через интервал — не опаздываем на него
+    if not should_start_precompute(now, delivery_at, lead + timedelta(minutes=PRECOMPUTE_PLAN_MINUTES)):
+        return
+
+    store = PrecomputedResults(RESULTS_FILE, delivery_date)
+    # после рестарта внутри окна успешно проверенные сайты не повторяем
+    pending = [url for url in urls if not (store.get(url) or {}).get("ok")]
+    deadline = time.monotonic() + (delivery_at - now).total_seconds() - PRECOMPUTE_MARGIN_MINUTES * 60
+
+    async def run(url: str) -> bool:
+        report, ok = await site_report(url)
+        await store.put(url, report, ok)
+        return ok
+
+    logger.info(f"Старт предрасчёта к {delivery_at:%Y-%m-%d %H:%M}, запас {lead}")
+    task = asyncio.create_task(precompute(pending, run, tracker, deadline))
+    task.add_done_callback(log_task_error)
+    app.bot_data.update(precompute_task=task, precompute_store=store, precompute_date=delivery_date)
+
 async def run_daily_checks(app):
-    bot = app.bot
-    data = load_user_sites()
-    for user_id, sites in data.items():
-        report = []
-        for url in sites:
-            try:
-                result = await run_checker("all", url)
-                report.append(f"✅ {url}:\n{result[:1000]}")
-            except Exception as e:
-                report.append(f"❌ {url}: {e}")
-        if report:
-            try:
-                await bot.send_message(chat_id=user_id, text="\n\n".join(report)[:4000])
-            except Exception:
-                logger.exception(f"Не удалось отправить отчёт пользователю {user_id}")
+    delivery: ReportDelivery = app.bot_data["delivery"]
+    today = datetime.now(ZoneInfo(TZ)).date().isoformat()
+    task = app.bot_data.pop("precompute_task", None)
+    store = app.bot_data.pop("precompute_store", None)
+    if store is None or store.delivery_date != today:
+        store = PrecomputedResults(RESULTS_FILE, today)
+
+    reports = await collect_daily_reports(load_user_sites(), store, site_report, app.bot_data["costs"], task)
+    for user_id, text in reports.items():
+        # отправка идёт в фоне через очередь и не задерживает следующие проверки
+        delivery.enqueue(user_id, text)
+    store.clear()
 
 async def on_startup(app):
+    delivery = ReportDelivery(app.bot, OUTBOX_FILE, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+                              max_age=OUTBOX_MAX_AGE_HOURS * 3600)
+    app.bot_data["delivery"] = delivery
+    app.bot_data["costs"] = SiteCostTracker(COSTS_FILE)
+    delivery.start()
+
     scheduler = AsyncIOScheduler(timezone=TZ)
     # каждый день в указанное время
     scheduler.add_job(run_daily_checks, "cron", hour=DAILY_HOUR, minute=DAILY_MINUTE, args=[app])
+    if PRECOMPUTE_WINDOW_MINUTES:
+        # момент старта пересчитывается по текущим оценкам; первый запуск сразу —
+        # он же подхватывает предрасчёт после рестарта внутри окна
+        scheduler.add_job(plan_precompute, "interval", minutes=PRECOMPUTE_PLAN_MINUTES,
+                          next_run_time=datetime.now(ZoneInfo(TZ)), args=[app])
+        logger.info(f"Precompute planner: window >= {PRECOMPUTE_WINDOW_MINUTES} min, "
+                    f"re-planned every {PRECOMPUTE_PLAN_MINUTES} min")
+    # повторная отправка того, что не удалось доставить
+    scheduler.add_job(delivery.resend_failed, "interval", minutes=OUTBOX_RETRY_MINUTES)
     scheduler.start()
     logger.info(f"Scheduler started: daily {DAILY_HOUR:02d}:{DAILY_MINUTE:02d} {TZ}")
 
+async def on_shutdown(app):
+    delivery = app.bot_data.get("delivery")
+    if delivery:
+        await delivery.stop()
+
 # === MAIN ===
 def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).post_init(on_startup).build()
+    app = ApplicationBuilder().token(BOT_TOKEN).post_init(on_startup).post_shutdown(on_shutdown).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(main_menu, pattern="^main_menu$"))
     app.add_handler(CallbackQueryHandler(autocheck_menu, pattern="^autocheck_menu$"))
@@ -0,0 +1,296 @@
+# delivery.py
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut
+
+logger = logging.getLogger("delivery")
+
+MAX_MESSAGE_LEN = 4000  # лимит Telegram — 4096, оставляем запас
+
+class TokenBucket:
+    """Простой token bucket: `rate` токенов в секунду, не больше `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько ждать до появления токена (0 — можно отправлять сейчас)."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LEN) -> List[str]:
+    """Режет длинный текст на части <= limit: по абзацам, затем по строкам, затем жёстко."""
+    parts: List[str] = []
+    current = ""
+    for block in text.split("\n\n"):
+        candidate = f"{current}\n\n{block}" if current else block
+        if len(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            parts.append(current)
+            current = ""
+        if len(block) <= limit:
+            current = block
+            continue
+        # абзац сам по себе длиннее лимита — режем по строкам
+        for line in block.split("\n"):
+            candidate = f"{current}\n{line}" if current else line
+            if len(candidate) <= limit:
+                current = candidate
+                continue
+            if current:
+                parts.append(current)
+            while len(line) > limit:
+                parts.append(line[:limit])
+                line = line[limit:]
+            current = line
+    if current:
+        parts.append(current)
+    return parts
+
+class ReportDelivery:
+    """Очередь исходящих отчётов, отвязанная от проверок.
+
+    Отчёт (уже разбитый на сообщения) хранится в outbox, пока не отправлена
+    последняя его часть, поэтому недоставленное переживает рестарт бота.
+    Части одного отчёта уходят строго по порядку: если часть не отправилась,
+    следующие ждут её. Outbox сохраняется в файл в фоне, не чаще раза
+    в `save_interval` секунд.
+
+    Отправка ограничена глобальным и per-chat token bucket'ами. Очередь ждёт
+    только глобальный лимит и RetryAfter от Telegram; отчёт в чат, исчерпавший
+    свой лимит, откладывается, а очередь идёт дальше. Так же откладываются
+    отчёты после ошибок отправки. Отчёты старше `max_age` секунд отбрасываются.
+
+    Доставка «хотя бы один раз»: после TimedOut сообщение могло уже дойти,
+    поэтому его повтор может дать дубль. Первый таймаут части повторяется
+    сразу и не считается попыткой, следующие — как обычные ошибки.
+    """
+
+    def __init__(self, bot, outbox_file: Path,
+                 global_rate: float = 25.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 max_attempts: int = 5, max_age: float = 24 * 3600, save_interval: float = 1.0):
+        self.bot = bot
+        self.outbox_file = outbox_file
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets: Dict[str, TokenBucket] = {}
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        self.save_interval = save_interval
+        self.outbox: Dict[str, dict] = self._load_outbox()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._dirty = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._saver: Optional[asyncio.Task] = None
+
+    # --- Outbox ---
+    def _load_outbox(self) -> Dict[str, dict]:
+        if self.outbox_file.exists():
+            with open(self.outbox_file, "r", encoding="utf-8") as f:
+                reports = json.load(f)
+            for report in reports:
+                report.setdefault("created", time.time())
+                report.setdefault("timed_out", False)
+            return {report["id"]: report for report in reports}
+        return {}
+
+    def _write_outbox(self, reports: List[dict]) -> None:
+        tmp = self.outbox_file.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        tmp.replace(self.outbox_file)
+
+    def _snapshot(self) -> List[dict]:
+        # копия делается в event loop, запись файла — в отдельном потоке
+        return [dict(report, parts=list(report["parts"])) for report in self.outbox.values()]
+
+    async def _run_saver(self) -> None:
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            try:
+                await asyncio.to_thread(self._write_outbox, self._snapshot())
+            except Exception:
+                logger.exception("Не удалось сохранить outbox")
+                self._dirty.set()
+            await asyncio.sleep(self.save_interval)
+
+    async def flush(self) -> None:
+        """Сразу записывает outbox на диск."""
+        self._dirty.clear()
+        await asyncio.to_thread(self._write_outbox, self._snapshot())
+
+    # --- Public API ---
+    def enqueue(self, chat_id: str, text: str) -> None:
+        """Ставит текст в очередь, разбивая его на сообщения допустимой длины."""
+        parts = split_message(text)
+        if not parts:
+            return
+        report = {"id": uuid.uuid4().hex, "chat_id": str(chat_id), "parts": parts,
+                  "attempts": 0, "timed_out": False, "failed": False, "created": time.time()}
+        self.outbox[report["id"]] = report
+        self.queue.put_nowait(report["id"])
+        self._dirty.set()
+
+    def _drop_stale(self) -> None:
+        now = time.time()
+        for report in list(self.outbox.values()):
+            if now - report["created"] > self.max_age:
+                logger.warning(f"Отчёт пользователю {report['chat_id']} устарел и отброшен "
+                               f"(осталось частей: {len(report['parts'])})")
+                self.outbox.pop(report["id"])
+                self._dirty.set()
+
+    async def resend_failed(self) -> int:
+        """Возвращает в очередь отчёты, исчерпавшие попытки отправки."""
+        self._drop_stale()
+        failed = [report for report in self.outbox.values() if report["failed"]]
+        for report in failed:
+            report["failed"] = False
+            report["attempts"] = 0
+            self.queue.put_nowait(report["id"])
+        if failed:
+            self._dirty.set()
+            logger.info(f"Повторная отправка {len(failed)} отчётов из outbox")
+        return len(failed)
+
+    def start(self) -> None:
+        # всё, что осталось в outbox после прошлого запуска, отправляем заново
+        self._drop_stale()
+        for report in self.outbox.values():
+            report["failed"] = False
+            report["attempts"] = 0
+            self.queue.put_nowait(report["id"])
+        if self.outbox:
+            logger.info(f"В outbox {len(self.outbox)} недоставленных отчётов")
+        self._worker = asyncio.create_task(self._run())
+        self._saver = asyncio.create_task(self._run_saver())
+
+    async def stop(self) -> None:
+        for task in (self._worker, self._saver):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._worker = self._saver = None
+        await self.flush()
+
+    # --- Worker ---
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire_global(self) -> None:
+        while True:
+            delay = self.global_bucket.delay()
+            if delay <= 0:
+                self.global_bucket.consume()
+                return
+            await asyncio.sleep(delay)
+
+    def _defer(self, report: dict, delay: float) -> None:
+        asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, report["id"])
+
+    async def _run(self) -> None:
+        while True:
+            report_id = await self.queue.get()
+            report = self.outbox.get(report_id)
+            try:
+                if report is None or report["failed"]:
+                    continue
+                if time.time() - report["created"] > self.max_age:
+                    self._drop_stale()
+                    continue
+                await self._deliver(report)
+            except Exception:
+                # не ошибка отправки, а сбой самой очереди — оставляем до resend_failed
+                logger.exception("Ошибка в очереди отправки")
+                report["failed"] = True
+                self._dirty.set()
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, report: dict) -> None:
+        chat_id = report["chat_id"]
+        chat_bucket = self._chat_bucket(chat_id)
+        while report["parts"]:
+            # лимит чата не держит очередь: откладываем отчёт, его части остаются по порядку
+            delay = chat_bucket.delay()
+            if delay > 0:
+                self._defer(report, delay)
+                return
+            await self._acquire_global()
+            chat_bucket.consume()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=report["parts"][0])
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Flood limit, пауза {retry_after} с")
+                await asyncio.sleep(retry_after)
+                continue
+            except (Forbidden, BadRequest) as e:
+                # бот заблокирован / чат не существует — повторять бессмысленно
+                logger.warning(f"Отчёт пользователю {chat_id} отброшен: {e}")
+                break
+            except TimedOut as e:
+                if not report["timed_out"]:
+                    report["timed_out"] = True
+                    logger.warning(f"Таймаут отправки пользователю {chat_id}, повторяем "
+                                   f"(сообщение могло дойти — возможен дубль): {e}")
+                    continue
+                self._retry_later(report, e)
+                return
+            except Exception as e:
+                self._retry_later(report, e)
+                return
+            report["parts"].pop(0)
+            report["attempts"] = 0
+            report["timed_out"] = False
+            self._dirty.set()
+        self.outbox.pop(report["id"], None)
+        self._dirty.set()
+
+    def _retry_later(self, report: dict, error: Exception) -> None:
+        chat_id = report["chat_id"]
+        report["attempts"] += 1
+        self._dirty.set()
+        if report["attempts"] >= self.max_attempts:
+            # оставшиеся части ждут resend_failed, чтобы не нарушить порядок
+            report["failed"] = True
+            logger.error(f"Не удалось отправить отчёт пользователю {chat_id}, "
+                         f"оставлено в outbox: {error}")
+            return
+        backoff = min(2 ** report["attempts"], 60)
+        logger.warning(f"Ошибка отправки пользователю {chat_id} "
+                       f"(попытка {report['attempts']}), повтор через {backoff} с: {error}")
+        self._defer(report, backoff)
@@ -0,0 +1,181 @@
+# planner.py
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from statistics import median
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("planner")
+
+DEFAULT_SITE_COST = 60.0  # секунд, пока для сайта нет замеров
+MAX_PRECOMPUTE_LEAD = timedelta(hours=23)  # иначе окно наедет на предыдущую рассылку
+
+class SiteCostTracker:
+    """Хранит сглаженную (EWMA) длительность полной проверки каждого сайта.
+
+    `record` меняет только память, на диск оценки пишет `save` в отдельном потоке.
+    """
+
+    def __init__(self, costs_file: Path, alpha: float = 0.3):
+        self.costs_file = costs_file
+        self.alpha = alpha
+        self.costs: Dict[str, float] = self._load()
+
+    def _load(self) -> Dict[str, float]:
+        if self.costs_file.exists():
+            with open(self.costs_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def _write(self, costs: Dict[str, float]) -> None:
+        tmp = self.costs_file.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(costs, f, ensure_ascii=False, indent=2)
+        tmp.replace(self.costs_file)
+
+    async def save(self) -> None:
+        await asyncio.to_thread(self._write, dict(self.costs))
+
+    def estimate(self, url: str) -> float:
+        if url in self.costs:
+            return self.costs[url]
+        # новый сайт — считаем «типичным» среди уже измеренных
+        return median(self.costs.values()) if self.costs else DEFAULT_SITE_COST
+
+    def total_estimate(self, urls: Iterable[str]) -> float:
+        return sum(self.estimate(url) for url in urls)
+
+    def record(self, url: str, seconds: float) -> None:
+        prev = self.costs.get(url)
+        self.costs[url] = seconds if prev is None else prev + self.alpha * (seconds - prev)
+
+    def prune(self, urls: Iterable[str]) -> None:
+        """Забывает сайты, которых больше нет ни у одного пользователя."""
+        keep = set(urls)
+        for url in [url for url in self.costs if url not in keep]:
+            del self.costs[url]
+
+class PrecomputedResults:
+    """Готовые отчёты по сайтам для одной рассылки, сохраняемые на диск.
+
+    Файл привязан к дате рассылки, поэтому рестарт внутри окна не теряет
+    уже сделанные проверки, а вчерашние результаты не попадут в сегодняшний отчёт.
+    """
+
+    def __init__(self, results_file: Path, delivery_date: str):
+        self.results_file = results_file
+        self.delivery_date = delivery_date
+        self.results: Dict[str, dict] = self._load()
+
+    def _load(self) -> Dict[str, dict]:
+        if self.results_file.exists():
+            with open(self.results_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("date") == self.delivery_date:
+                return data.get("results", {})
+        return {}
+
+    def _write(self, data: dict) -> None:
+        tmp = self.results_file.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        tmp.replace(self.results_file)
+
+    def get(self, url: str) -> Optional[dict]:
+        """{"report": текст, "ok": прошла ли проверка} или None."""
+        return self.results.get(url)
+
+    async def put(self, url: str, report: str, ok: bool) -> None:
+        self.results[url] = {"report": report, "ok": ok}
+        data = {"date": self.delivery_date, "results": dict(self.results)}
+        await asyncio.to_thread(self._write, data)
+
+    def clear(self) -> None:
+        self.results_file.unlink(missing_ok=True)
+
+# === Время рассылки и окно предрасчёта ===
+def next_delivery_time(now: datetime, hour: int, minute: int) -> datetime:
+    at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return at if at > now else at + timedelta(days=1)
+
+def precompute_lead(total_estimate: float, window_minutes: int, margin_minutes: int) -> timedelta:
+    """За сколько до рассылки начинать предрасчёт.
+
+    Не меньше настроенного окна, но если проверки по оценке не влезают в него,
+    старт сдвигается раньше — на сумму оценок плюс запас.
+    """
+    needed = timedelta(seconds=total_estimate, minutes=margin_minutes)
+    lead = max(timedelta(minutes=window_minutes), needed)
+    if lead > MAX_PRECOMPUTE_LEAD:
+        logger.warning(f"Оценка проверок ({total_estimate:.0f} с) не помещается в сутки, "
+                       f"часть отчётов будет готова позже")
+        lead = MAX_PRECOMPUTE_LEAD
+    return lead
+
+def should_start_precompute(now: datetime, delivery_at: datetime, lead: timedelta) -> bool:
+    return delivery_at - now <= lead
+
+# === Предрасчёт и сбор отчётов ===
+async def precompute(urls: List[str], run: Callable[[str], Awaitable[bool]],
+                     tracker: SiteCostTracker, deadline: float) -> None:
+    """Последовательно прогоняет `run` по сайтам, растягивая нагрузку до `deadline`.
+
+    `deadline` — момент по time.monotonic(), к которому всё должно быть готово.
+    Перед каждым сайтом пауза пересчитывается из оставшегося времени и оценок
+    оставшихся проверок, так что ошибки оценок выравниваются по ходу.
+    Если работы больше, чем времени, проверки идут подряд без пауз.
+    Длительность запоминается только для успешных проверок (`run` вернул True):
+    быстрый отказ сайта не должен занижать его оценку.
+    """
+    # тяжёлые сайты первыми: их погрешность успевает компенсироваться
+    pending = sorted(urls, key=tracker.estimate, reverse=True)
+    total = tracker.total_estimate(pending)
+    window = deadline - time.monotonic()
+    logger.info(f"Предрасчёт {len(pending)} сайтов, оценка {total:.0f} с, окно {window:.0f} с")
+
+    try:
+        while pending:
+            slack = deadline - time.monotonic() - tracker.total_estimate(pending)
+            gap = slack / len(pending)
+            if gap > 0:
+                await asyncio.sleep(gap)
+
+            url = pending.pop(0)
+            started = time.monotonic()
+            if await run(url):
+                tracker.record(url, time.monotonic() - started)
+    finally:
+        await tracker.save()
+
+async def collect_daily_reports(user_sites: Dict[str, List[str]], store: PrecomputedResults,
+                                check: Callable[[str], Awaitable[Tuple[str, bool]]],
+                                tracker: SiteCostTracker,
+                                precompute_task: Optional[asyncio.Task] = None) -> Dict[str, str]:
+    """Собирает отчёты пользователей из предрасчитанных результатов.
+
+    Если предрасчёт ещё идёт, сначала дожидается его, а не проверяет сайты
+    повторно. Сайты без результата (добавлены после начала окна) и с ошибкой
+    (она могла быть временной) проверяются сейчас, каждый — один раз.
+    """
+    if precompute_task and not precompute_task.done():
+        logger.warning("Предрасчёт ещё идёт, ждём его завершения")
+        await asyncio.gather(precompute_task, return_exceptions=True)
+
+    results = {url: result["report"] for url, result in store.results.items() if result["ok"]}
+    reports: Dict[str, str] = {}
+    for user_id, sites in user_sites.items():
+        for url in sites:
+            if url not in results:
+                started = time.monotonic()
+                results[url], ok = await check(url)
+                if ok:
+                    tracker.record(url, time.monotonic() - started)
+        if sites:
+            reports[user_id] = "\n\n".join(results[url] for url in sites)
+
+    tracker.prune(url for sites in user_sites.values() for url in sites)
+    await tracker.save()
+    return reports
@@ -0,0 +1,194 @@
+# test_delivery.py
+import asyncio
+import time
+
+from telegram.error import Forbidden, NetworkError, RetryAfter, TimedOut
+
+from delivery import ReportDelivery, split_message
+
+class FakeBot:
+    """Запоминает отправленное; `errors[chat_id]` — исключения для ближайших попыток."""
+
+    def __init__(self, errors=None, always_fail=()):
+        self.sent = []
+        self.errors = errors or {}
+        self.always_fail = set(always_fail)
+
+    async def send_message(self, chat_id, text):
+        if chat_id in self.always_fail:
+            raise NetworkError("connection reset")
+        pending = self.errors.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.sent.append((chat_id, text))
+
+def make_delivery(bot, tmp_path, **kwargs):
+    return ReportDelivery(bot, tmp_path / "outbox.json", global_rate=1000, chat_rate=1000,
+                          chat_burst=1000, **kwargs)
+
+def long_report():
+    return "\n\n".join(f"site {i}:\n" + "x" * 1500 for i in range(6))
+
+# --- split_message ---
+def test_split_short_text_is_single_part():
+    assert split_message("hello\n\nworld") == ["hello\n\nworld"]
+    assert split_message("") == []
+
+def test_split_parts_fit_limit_and_keep_content():
+    text = "\n\n".join(["a" * 1500] * 5) + "\n\n" + "b" * 9000 + "\n\n" + "\n".join(["c" * 300] * 30)
+    parts = split_message(text, limit=4000)
+    assert len(parts) > 1
+    assert all(len(p) <= 4000 for p in parts)
+    assert "".join(parts).replace("\n", "") == text.replace("\n", "")
+
+# --- ReportDelivery ---
+def test_retry_after_pauses_and_resends_in_order(tmp_path):
+    async def scenario():
+        bot = FakeBot(errors={"1": [RetryAfter(0)]})
+        delivery = make_delivery(bot, tmp_path)
+        delivery.enqueue("1", long_report())
+        parts = list(delivery.outbox.values())[0]["parts"][:]
+        await delivery._deliver(list(delivery.outbox.values())[0])
+        assert [text for _, text in bot.sent] == parts
+        assert delivery.outbox == {}
+    asyncio.run(scenario())
+
+def test_forbidden_drops_report(tmp_path):
+    async def scenario():
+        bot = FakeBot(errors={"1": [Forbidden("blocked")]})
+        delivery = make_delivery(bot, tmp_path)
+        delivery.enqueue("1", long_report())
+        await delivery._deliver(list(delivery.outbox.values())[0])
+        assert bot.sent == []
+        assert delivery.outbox == {}
+    asyncio.run(scenario())
+
+def test_max_attempts_keeps_remaining_parts_in_order(tmp_path):
+    async def scenario():
+        bot = FakeBot()
+        delivery = make_delivery(bot, tmp_path, max_attempts=2)
+        delivery.enqueue("1", long_report())
+        report = list(delivery.outbox.values())[0]
+        parts = report["parts"][:]
+
+        # первая часть уходит, вторая дважды падает
+        original = bot.send_message
+
+        async def fail_second(chat_id, text):
+            if text == parts[1]:
+                raise NetworkError("connection reset")
+            await original(chat_id, text)
+        bot.send_message = fail_second
+
+        await delivery._deliver(report)
+        assert not report["failed"] and report["attempts"] == 1
+        await delivery._deliver(report)
+        assert report["failed"]
+        assert [text for _, text in bot.sent] == parts[:1]
+        assert report["parts"] == parts[1:]
+
+        bot.send_message = original
+        assert await delivery.resend_failed() == 1
+        await delivery._deliver(report)
+        assert [text for _, text in bot.sent] == parts
+        assert delivery.outbox == {}
+    asyncio.run(scenario())
+
+def test_failing_chat_does_not_block_others(tmp_path):
+    async def scenario():
+        bot = FakeBot(always_fail={"1"})
+        delivery = make_delivery(bot, tmp_path)
+        delivery.start()
+        delivery.enqueue("1", "report for 1")
+        delivery.enqueue("2", "report for 2")
+        await asyncio.wait_for(delivery.queue.join(), timeout=1)
+        assert bot.sent == [("2", "report for 2")]
+        await delivery.stop()
+    asyncio.run(scenario())
+
+def test_outbox_survives_restart(tmp_path):
+    async def scenario():
+        delivery = make_delivery(FakeBot(always_fail={"1"}), tmp_path)
+        delivery.enqueue("1", "pending report")
+        await delivery.stop()
+
+        bot = FakeBot()
+        restarted = make_delivery(bot, tmp_path)
+        restarted.start()
+        await asyncio.wait_for(restarted.queue.join(), timeout=1)
+        assert bot.sent == [("1", "pending report")]
+        await restarted.stop()
+    asyncio.run(scenario())
+
+def test_unexpected_worker_error_marks_report_failed(tmp_path):
+    async def scenario():
+        delivery = make_delivery(FakeBot(), tmp_path)
+
+        async def broken():
+            raise OSError("disk full")
+        delivery._acquire_global = broken
+        delivery.start()
+        delivery.enqueue("1", "report")
+        await asyncio.wait_for(delivery.queue.join(), timeout=1)
+        assert list(delivery.outbox.values())[0]["failed"]
+        await delivery.stop()
+    asyncio.run(scenario())
+
+def test_chat_limit_does_not_delay_other_chats(tmp_path):
+    async def scenario():
+        bot = FakeBot()
+        delivery = ReportDelivery(bot, tmp_path / "outbox.json", global_rate=1000,
+                                  chat_rate=2, chat_burst=1)
+        delivery.start()
+        delivery.enqueue("1", long_report())
+        delivery.enqueue("2", "short report")
+        parts = list(delivery.outbox.values())[0]["parts"][:]
+        assert len(parts) > 1
+
+        started = time.monotonic()
+        while ("2", "short report") not in bot.sent:
+            await asyncio.sleep(0.01)
+        assert time.monotonic() - started < 0.2
+        assert bot.sent[:2] == [("1", parts[0]), ("2", "short report")]
+
+        # части длинного отчёта всё равно приходят по порядку
+        await asyncio.wait_for(delivery.queue.join(), timeout=1)
+        while delivery.outbox:
+            await asyncio.sleep(0.05)
+        assert [text for chat, text in bot.sent if chat == "1"] == parts
+        await delivery.stop()
+    asyncio.run(scenario())
+
+def test_first_timeout_is_retried_without_counting_attempt(tmp_path):
+    async def scenario():
+        bot = FakeBot(errors={"1": [TimedOut()]})
+        delivery = make_delivery(bot, tmp_path)
+        delivery.enqueue("1", "report")
+        report = list(delivery.outbox.values())[0]
+        await delivery._deliver(report)
+        assert bot.sent == [("1", "report")]
+        assert report["attempts"] == 0
+        assert delivery.outbox == {}
+    asyncio.run(scenario())
+
+def test_repeated_timeout_counts_as_attempt(tmp_path):
+    async def scenario():
+        bot = FakeBot(errors={"1": [TimedOut(), TimedOut()]})
+        delivery = make_delivery(bot, tmp_path)
+        delivery.enqueue("1", "report")
+        report = list(delivery.outbox.values())[0]
+        await delivery._deliver(report)
+        assert bot.sent == []
+        assert report["attempts"] == 1
+    asyncio.run(scenario())
+
+def test_stale_reports_are_dropped(tmp_path):
+    async def scenario():
+        delivery = make_delivery(FakeBot(), tmp_path, max_age=3600)
+        delivery.enqueue("1", "old report")
+        report = list(delivery.outbox.values())[0]
+        report["failed"] = True
+        report["created"] = time.time() - 2 * 3600
+        assert await delivery.resend_failed() == 0
+        assert delivery.outbox == {}
+    asyncio.run(scenario())
@@ -0,0 +1,157 @@
+# test_planner.py
+import asyncio
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from planner import (
+    MAX_PRECOMPUTE_LEAD, PrecomputedResults, SiteCostTracker, collect_daily_reports,
+    next_delivery_time, precompute, precompute_lead, should_start_precompute
+)
+
+RIGA = ZoneInfo("Europe/Riga")
+
+def make_tracker(tmp_path, costs=None):
+    tracker = SiteCostTracker(tmp_path / "costs.json")
+    tracker.costs = dict(costs or {})
+    return tracker
+
+class FakeCheck:
+    """Имитирует site_report: запоминает вызовы, `failing` — сайты с ошибкой."""
+
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = set(failing)
+
+    async def __call__(self, url):
+        self.calls.append(url)
+        if url in self.failing:
+            return f"❌ {url}: down", False
+        return f"✅ {url}: fresh", True
+
+# --- precompute ---
+def test_precompute_records_only_successful_checks(tmp_path):
+    tracker = make_tracker(tmp_path, {"ok": 0.01, "down": 5.0})
+
+    async def run(url):
+        return url == "ok"
+
+    asyncio.run(precompute(["ok", "down"], run, tracker, time.monotonic()))
+    assert tracker.costs["down"] == 5.0
+    assert tracker.costs["ok"] < 0.01
+
+def test_precompute_spreads_checks_until_deadline(tmp_path):
+    tracker = make_tracker(tmp_path, {"a": 0.05, "b": 0.05})
+    started = {}
+
+    async def run(url):
+        started[url] = time.monotonic()
+        await asyncio.sleep(0.05)
+        return True
+
+    t0 = time.monotonic()
+    asyncio.run(precompute(["a", "b"], run, tracker, t0 + 0.5))
+    assert started["a"] - t0 > 0.1
+    assert time.monotonic() - t0 < 0.7
+
+def test_precompute_saves_costs_once_at_the_end(tmp_path):
+    tracker = make_tracker(tmp_path)
+
+    async def run(url):
+        assert not tracker.costs_file.exists()
+        return True
+
+    asyncio.run(precompute(["a", "b"], run, tracker, time.monotonic()))
+    assert set(SiteCostTracker(tracker.costs_file).costs) == {"a", "b"}
+
+# --- окно предрасчёта ---
+def test_lead_is_at_least_the_configured_window():
+    assert precompute_lead(60, window_minutes=120, margin_minutes=10) == timedelta(minutes=120)
+
+def test_more_sites_start_earlier(tmp_path):
+    tracker = make_tracker(tmp_path)
+    few = [f"https://site{i}.example" for i in range(50)]
+    many = [f"https://site{i}.example" for i in range(500)]
+    lead_few = precompute_lead(tracker.total_estimate(few), 120, 10)
+    lead_many = precompute_lead(tracker.total_estimate(many), 120, 10)
+
+    # 500 сайтов × 60 с = 500 минут — окно в 120 минут расширяется, чтобы успеть к рассылке
+    assert lead_few == timedelta(minutes=120)
+    assert lead_many == timedelta(minutes=510)
+
+    delivery_at = datetime(2026, 10, 20, 9, 0, tzinfo=RIGA)
+    at_0530 = datetime(2026, 10, 20, 5, 30, tzinfo=RIGA)
+    assert should_start_precompute(at_0530, delivery_at, lead_many)
+    assert not should_start_precompute(at_0530, delivery_at, lead_few)
+
+def test_lead_is_capped_below_a_day():
+    assert precompute_lead(10 ** 6, 120, 10) == MAX_PRECOMPUTE_LEAD
+
+def test_window_across_midnight():
+    now = datetime(2026, 10, 19, 23, 30, tzinfo=RIGA)
+    delivery_at = next_delivery_time(now, 0, 30)
+    assert delivery_at == datetime(2026, 10, 20, 0, 30, tzinfo=RIGA)
+    assert should_start_precompute(now, delivery_at, timedelta(minutes=120))
+
+    earlier = datetime(2026, 10, 19, 22, 0, tzinfo=RIGA)
+    assert not should_start_precompute(earlier, next_delivery_time(earlier, 0, 30), timedelta(minutes=120))
+
+def test_delivery_time_rolls_over_after_it_passed():
+    now = datetime(2026, 10, 19, 9, 0, 5, tzinfo=RIGA)
+    assert next_delivery_time(now, 9, 0) == datetime(2026, 10, 20, 9, 0, tzinfo=RIGA)
+
+# --- хранилище результатов ---
+def test_precomputed_results_are_tied_to_delivery_date(tmp_path):
+    path = tmp_path / "results.json"
+    store = PrecomputedResults(path, "2026-10-19")
+    asyncio.run(store.put("https://example.com", "✅ report", True))
+
+    assert PrecomputedResults(path, "2026-10-19").get("https://example.com") == {"report": "✅ report", "ok": True}
+    assert PrecomputedResults(path, "2026-10-20").get("https://example.com") is None
+    store.clear()
+    assert not path.exists()
+
+# --- сбор отчётов к рассылке ---
+def test_collect_reuses_successful_and_rechecks_failed_results(tmp_path):
+    async def scenario():
+        store = PrecomputedResults(tmp_path / "results.json", "2026-10-20")
+        await store.put("https://ok.example", "✅ https://ok.example: cached", True)
+        await store.put("https://flaky.example", "❌ https://flaky.example: timeout", False)
+        check = FakeCheck()
+        tracker = make_tracker(tmp_path)
+        reports = await collect_daily_reports(
+            {"1": ["https://ok.example", "https://flaky.example"]}, store, check, tracker)
+        assert check.calls == ["https://flaky.example"]
+        assert reports == {"1": "✅ https://ok.example: cached\n\n✅ https://flaky.example: fresh"}
+    asyncio.run(scenario())
+
+def test_collect_checks_new_sites_once_and_records_only_success(tmp_path):
+    async def scenario():
+        store = PrecomputedResults(tmp_path / "results.json", "2026-10-20")
+        check = FakeCheck(failing={"https://down.example"})
+        tracker = make_tracker(tmp_path, {"https://removed.example": 30.0})
+        user_sites = {"1": ["https://new.example", "https://down.example"], "2": ["https://new.example"]}
+        reports = await collect_daily_reports(user_sites, store, check, tracker)
+
+        assert check.calls == ["https://new.example", "https://down.example"]
+        assert reports["2"] == "✅ https://new.example: fresh"
+        # ошибка не попадает в оценки, удалённые сайты забываются
+        assert set(tracker.costs) == {"https://new.example"}
+        assert set(SiteCostTracker(tracker.costs_file).costs) == {"https://new.example"}
+    asyncio.run(scenario())
+
+def test_collect_waits_for_overrunning_precompute(tmp_path):
+    async def scenario():
+        store = PrecomputedResults(tmp_path / "results.json", "2026-10-20")
+
+        async def slow_precompute():
+            await asyncio.sleep(0.05)
+            await store.put("https://slow.example", "✅ https://slow.example: precomputed", True)
+
+        task = asyncio.create_task(slow_precompute())
+        check = FakeCheck()
+        reports = await collect_daily_reports(
+            {"1": ["https://slow.example"]}, store, check, make_tracker(tmp_path), task)
+        assert check.calls == []
+        assert reports == {"1": "✅ https://slow.example: precomputed"}
+    asyncio.run(scenario())